@@ -3,11 +3,12 @@ from __future__ import annotations
 from typing import Optional, Tuple, TYPE_CHECKING
 
 import color
+from entity import Item
 import exceptions
 
 if TYPE_CHECKING:
     from engine import Engine
-    from entity import Actor, Entity, Item
+    from entity import Actor, Entity
 
 
 
@@ -44,8 +45,10 @@ class PickupAction(Action):
         actor_location_y = self.entity.y
         inventory = self.entity.inventory
 
-        for item in list(self.engine.game_map.items):
-            if actor_location_x == item.x and actor_location_y == item.y:
+        for item in list(
+            self.engine.game_map.get_entities_at_location(actor_location_x, actor_location_y)
+        ):
+            if isinstance(item, Item):
                 if len(inventory.items) >= inventory.capacity:
                     raise exceptions.Impossible("Your inventory is full.")
                 
@@ -53,11 +56,11 @@ class PickupAction(Action):
                 # もし拾ったものがゴールドだったら、即座に使う
                 if item.name == "Gold":
                     item.consumable.activate(self)
-                    self.engine.game_map.entities.remove(item)
+                    self.engine.game_map.remove_entity(item)
                     return # ゴールドを拾ったら処理終了
                 else:
                     # 通常のアイテム拾得ロジック
-                    self.engine.game_map.entities.remove(item)
+                    self.engine.game_map.remove_entity(item)
                     item.parent = self.entity.inventory
                     inventory.items.append(item)
 
@@ -152,10 +155,17 @@ class ActionWithDirection(Action):
     
 
 class MeleeAction(ActionWithDirection):
+    NOISE_RADIUS = 6
+
     def perform(self) -> None:
         target = self.target_actor
         if not target:
             raise exceptions.Impossible("Nothing to attack.")
+
+        # The sound of fighting wakes up nearby sleeping monsters.
+        self.engine.game_map.wake_actors_near(
+            self.entity.x, self.entity.y, self.NOISE_RADIUS
+        )
         
         # === 最低ダメージ実装 ===
         # 単純な引き算で「素のダメージ（差分）」を出す
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Compare the cost of the FOV algorithms, and of full-map vs windowed FOV.
+
+Run from the repository root:  python benchmarks/bench_fov.py
+"""
+from __future__ import annotations
+
+import os
+import random
+import sys
+import timeit
+
+import numpy as np  # type: ignore
+from tcod.map import compute_fov
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from engine import Engine  # noqa: E402
+import setup_game  # noqa: E402
+
+REPEATS = 1000
+
+
+def full_fov(transparent: np.ndarray, x: int, y: int, radius: int, algorithm: int) -> None:
+    compute_fov(transparent, (x, y), radius=radius, algorithm=algorithm)
+
+
+def windowed_fov(transparent: np.ndarray, x: int, y: int, radius: int, algorithm: int) -> None:
+    x1, y1 = max(0, x - radius), max(0, y - radius)
+    compute_fov(
+        transparent[x1 : x + radius + 1, y1 : y + radius + 1],
+        (x - x1, y - y1),
+        radius=radius,
+        algorithm=algorithm,
+    )
+
+
+def main() -> None:
+    random.seed(0)
+    engine = setup_game.new_game()
+    floor = engine.game_map.tiles["transparent"]
+
+    maps = {
+        f"{floor.shape[0]}x{floor.shape[1]} floor": floor,
+        # A large map made of copies of the floor, to show how cost scales.
+        "5x5 tiled floor": np.asfortranarray(np.tile(floor, (5, 5))),
+    }
+    for map_name, transparent in maps.items():
+        spots = np.argwhere(transparent)
+        points = [tuple(spots[random.randrange(len(spots))]) for _ in range(REPEATS)]
+        print(f"{map_name} ({transparent.shape[0]}x{transparent.shape[1]}), radius {Engine.fov_radius}")
+        for name, algorithm in Engine.FOV_ALGORITHMS.items():
+            for mode, func in (("full", full_fov), ("windowed", windowed_fov)):
+                seconds = timeit.timeit(
+                    lambda: [
+                        func(transparent, int(x), int(y), Engine.fov_radius, algorithm)
+                        for x, y in points
+                    ],
+                    number=1,
+                )
+                print(f"  {name:<14} {mode:<9} {seconds / REPEATS * 1e6:8.1f} us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,8 @@
 from __future__ import annotations
 
-import random
-from typing import List, Optional, Tuple, TYPE_CHECKING
+from collections import deque
+from typing import Deque, List, Optional, Tuple, TYPE_CHECKING
 
-import numpy as np  # type: ignore
 import tcod
 
 from actions import Action, BumpAction, MeleeAction, MovementAction, WaitAction
@@ -14,30 +13,31 @@ if TYPE_CHECKING:
 
 
 class BaseAI(Action):
+    # When set, get_path_to only searches this many tiles around the actor.
+    # This caps the cost of a single query no matter how large the map is.
+    path_search_radius: Optional[int] = None
 
     def perform(self) -> None:
         raise NotImplementedError()
 
-    def get_path_to(self, dest_x: int, dest_y: int) -> List[Tuple[int, int]]:
+    def get_path_to(
+        self, dest_x: int, dest_y: int, max_radius: Optional[int] = None
+    ) -> List[Tuple[int, int]]:
         """Compute and return a path to the target position.
 
+        `max_radius` (or `path_search_radius` if not given) limits the A* search
+        to a window of that many tiles around the actor.  Destinations outside of
+        the window, or only reachable by leaving it, count as unreachable.
+
         If there is no valid path then returns an empty list.
         """
-        # Copy the walkable array.
-        cost = np.array(self.entity.gamemap.tiles["walkable"], dtype=np.int8)
-
-        for entity in self.entity.gamemap.entities:
-            # Check that an enitiy blocks movement and the cost isn't zero (blocking.)
-            if entity.blocks_movement and cost[entity.x, entity.y]:
-                # Add to the cost of a blocked position.
-                # A lower number means more enemies will crowd behind each other in
-                # hallways.  A higher number means enemies will take longer paths in
-                # order to surround the player.
-                cost[entity.x, entity.y] += 10
-
-        # Create a graph from the cost array and pass that graph to a new pathfinder.
-        graph = tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3)
-        pathfinder = tcod.path.Pathfinder(graph)
+        if max_radius is None:
+            max_radius = self.path_search_radius
+        if max_radius is not None:
+            return self._get_bounded_path_to(dest_x, dest_y, max_radius)
+
+        # Reuse the maps graph, which tracks walls and blocking entities.
+        pathfinder = tcod.path.Pathfinder(self.entity.gamemap.path_graph)
 
         pathfinder.add_root((self.entity.x, self.entity.y))  # Start position.
 
@@ -47,6 +47,118 @@ class BaseAI(Action):
         # Convert from List[List[int]] to List[Tuple[int, int]].
         return [(index[0], index[1]) for index in path]
 
+    def _get_bounded_path_to(
+        self, dest_x: int, dest_y: int, max_radius: int
+    ) -> List[Tuple[int, int]]:
+        """Run an A* search restricted to `max_radius` tiles around the actor."""
+        gamemap = self.entity.gamemap
+        x, y = self.entity.x, self.entity.y
+
+        if max(abs(dest_x - x), abs(dest_y - y)) > max_radius:
+            return []  # Out of the search budget.
+
+        return self._get_path_in_window(
+            dest_x,
+            dest_y,
+            (max(0, x - max_radius), max(0, y - max_radius)),
+            (min(gamemap.width, x + max_radius + 1), min(gamemap.height, y + max_radius + 1)),
+        )
+
+    def _get_path_in_window(
+        self,
+        dest_x: int,
+        dest_y: int,
+        top_left: Tuple[int, int],
+        bottom_right: Tuple[int, int],
+    ) -> List[Tuple[int, int]]:
+        """Run an A* search over the part of the map between these corners.
+
+        `bottom_right` is exclusive.  The actor and destination must be inside.
+        """
+        x1, y1 = top_left
+        x2, y2 = bottom_right
+
+        # Crop the maps cost array to the search window.
+        graph = tcod.path.SimpleGraph(
+            cost=self.entity.gamemap.path_cost[x1:x2, y1:y2], cardinal=2, diagonal=3
+        )
+        pathfinder = tcod.path.Pathfinder(graph)
+
+        pathfinder.add_root((self.entity.x - x1, self.entity.y - y1))  # Start position.
+
+        # path_to uses the graphs heuristic, so this is an A* search.
+        path: List[List[int]] = pathfinder.path_to((dest_x - x1, dest_y - y1))[
+            1:
+        ].tolist()
+
+        # Convert window indexes back into map coordinates.
+        return [(index[0] + x1, index[1] + y1) for index in path]
+
+    def get_room_path_to(self, dest_x: int, dest_y: int) -> List[Tuple[int, int]]:
+        """Compute a path using the maps room graph, for maps too large to search.
+
+        A route is planned over the rooms first, then a tile path is searched
+        only inside the current room and the next room on the route (which also
+        contains the tunnel between them).  The returned path ends at the center
+        of the next room, or at the destination once it is that close, so call
+        this again when the path runs out.
+
+        Falls back to `get_path_to` if either end is outside of a room.
+        If there is no valid path then returns an empty list.
+        """
+        gamemap = self.entity.gamemap
+        start_room = gamemap.get_room_at(self.entity.x, self.entity.y)
+        dest_room = gamemap.get_room_at(dest_x, dest_y)
+
+        if start_room is None or dest_room is None or start_room == dest_room:
+            return self.get_path_to(dest_x, dest_y)
+
+        route = gamemap.find_room_route(start_room, dest_room)
+        if not route:
+            return []
+
+        current, following = gamemap.rooms[start_room], gamemap.rooms[route[1]]
+        if route[1] == dest_room:
+            goal_x, goal_y = dest_x, dest_y
+        else:
+            goal_x, goal_y = following.center
+
+        # Room walls are at x1 and x2, so include both in the window.
+        return self._get_path_in_window(
+            goal_x,
+            goal_y,
+            (min(current.x1, following.x1), min(current.y1, following.y1)),
+            (max(current.x2, following.x2) + 1, max(current.y2, following.y2) + 1),
+        )
+
+    def get_path_to_player(self) -> List[Tuple[int, int]]:
+        """Return a path to the player using the engines shared player pathfinder.
+
+        This walks downhill on a distance map which is computed once per round of
+        enemy turns, instead of running a new search for every enemy.
+        If there is no valid path then returns an empty list.
+        """
+        pathfinder = self.engine.player_pathfinder
+
+        # Follow the distance map back to the player and remove the starting point.
+        path: List[List[int]] = pathfinder.path_from(
+            (self.entity.x, self.entity.y)
+        )[1:].tolist()
+
+        return [(index[0], index[1]) for index in path]
+
+
+CONFUSED_DIRECTIONS = [
+    (-1, -1),  # Northwest
+    (0, -1),  # North
+    (1, -1),  # Northeast
+    (-1, 0),  # West
+    (1, 0),  # East
+    (-1, 1),  # Southwest
+    (0, 1),  # South
+    (1, 1),  # Southeast
+]
+
 
 class ConfusedEnemy(BaseAI):
     """
@@ -61,6 +173,10 @@ class ConfusedEnemy(BaseAI):
 
         self.previous_ai = previous_ai
         self.turns_remaining = turns_remaining
+        # The direction of every turn of confusion, drawn at once.
+        self.directions: List[int] = self.engine.game_world.ai_rng.integers(
+            len(CONFUSED_DIRECTIONS), size=turns_remaining
+        ).tolist()
 
     def perform(self) -> None:
         # Revert the AI back to the original state if the effect has run its course.
@@ -71,18 +187,9 @@ class ConfusedEnemy(BaseAI):
             self.entity.ai = self.previous_ai
         else:
             # Pick a random direction
-            direction_x, direction_y = random.choice(
-                [
-                    (-1, -1),  # Northwest
-                    (0, -1),  # North
-                    (1, -1),  # Northeast
-                    (-1, 0),  # West
-                    (1, 0),  # East
-                    (-1, 1),  # Southwest
-                    (0, 1),  # South
-                    (1, 1),  # Southeast
-                ]
-            )
+            direction_x, direction_y = CONFUSED_DIRECTIONS[
+                self.directions[len(self.directions) - self.turns_remaining]
+            ]
 
             self.turns_remaining -= 1
 
@@ -101,9 +208,33 @@ class ConfusedEnemy(BaseAI):
 
 
 class HostileEnemy(BaseAI):
+    # How far (in tiles) the player may move away from the end of the current
+    # path before it is recomputed.  Short paths are always kept exact.
+    REPATH_TOLERANCE = 2
+
     def __init__(self, entity: Actor):
         super().__init__(entity)
-        self.path: List[Tuple[int, int]] = []
+        self.path: Deque[Tuple[int, int]] = deque()
+        self.path_target: Optional[Tuple[int, int]] = None
+        self.path_map_version = -1
+
+    def needs_new_path(self, target_x: int, target_y: int) -> bool:
+        """Return True if the current path can not be reused to chase the target."""
+        if not self.path or self.path_target is None:
+            return True
+        if self.path_map_version != self.engine.game_map.version:
+            return True
+
+        next_x, next_y = self.path[0]
+        if max(abs(next_x - self.entity.x), abs(next_y - self.entity.y)) != 1:
+            return True  # Knocked off the path, for example while confused.
+        if self.engine.game_map.get_blocking_entity_at_location(next_x, next_y):
+            return True
+
+        drift = max(
+            abs(target_x - self.path_target[0]), abs(target_y - self.path_target[1])
+        )
+        return drift > min(self.REPATH_TOLERANCE, len(self.path) // 4)
 
     def perform(self) -> None:
         target = self.engine.player
@@ -121,10 +252,13 @@ class HostileEnemy(BaseAI):
                 except exceptions.Impossible:
                     return None
 
-            self.path = self.get_path_to(target.x, target.y)
+            if self.needs_new_path(target.x, target.y):
+                self.path = deque(self.get_path_to_player())
+                self.path_target = target.x, target.y
+                self.path_map_version = self.engine.game_map.version
 
         if self.path:
-            dest_x, dest_y = self.path.pop(0)
+            dest_x, dest_y = self.path.popleft()
             #return MovementAction(
             #    self.entity, dest_x - self.entity.x, dest_y - self.entity.y,
             #).perform()
@@ -136,5 +270,9 @@ class HostileEnemy(BaseAI):
                 ).perform()
             except exceptions.Impossible:
                 return None
-            
-        return WaitAction(self.entity).perform()
\ No newline at end of file
+
+        if distance > self.engine.wake_radius:
+            # Nothing to chase and far from the player, sleep until woken.
+            self.engine.game_map.park(self.entity)
+
+        return WaitAction(self.entity).perform()
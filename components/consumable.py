@@ -114,7 +114,8 @@ class FireballDamageConsumable(Consumable):
             raise Impossible("You cannot target an area that you cannot see.")
 
         targets_hit = False
-        for actor in self.engine.game_map.actors:
+        # Copy the living actors, since the explosion may kill some of them.
+        for actor in list(self.engine.game_map.actors):
             if actor.distance(*target_xy) <= self.radius:
                 # getattr を使って耐性を取得。Fighterがなければ 1.0
                 resistance = getattr(actor.fighter, "magic_resistance", 1.0)
@@ -0,0 +1,62 @@
+"""Off-screen consoles for panels which rarely change between frames."""
+from __future__ import annotations
+
+from typing import Callable, Dict, Hashable, Tuple
+
+import tcod
+
+
+class ConsoleCache:
+    """Keeps a drawn console per panel, redrawn only when its inputs change.
+
+    Each panel is identified by a name, and `inputs` is any hashable value
+    holding everything the panel draws from.  As long as the same inputs are
+    given the stored console is returned as is, ready to be blitted.
+    """
+
+    def __init__(self) -> None:
+        self._panels: Dict[str, Tuple[Hashable, tcod.console.Console]] = {}
+
+    def get(
+        self,
+        panel: str,
+        inputs: Hashable,
+        width: int,
+        height: int,
+        draw: Callable[[tcod.console.Console], None],
+    ) -> tcod.console.Console:
+        """Return the console of `panel`, calling `draw` on it if it is out of date."""
+        cached = self._panels.get(panel)
+        if cached is not None and (cached[1].width, cached[1].height) == (width, height):
+            cached_inputs, panel_console = cached
+            if cached_inputs == inputs:
+                return panel_console
+            panel_console.clear()  # Reuse the allocation for the new contents.
+        else:
+            panel_console = tcod.console.Console(width, height, order="F")
+
+        draw(panel_console)
+        self._panels[panel] = (inputs, panel_console)
+        return panel_console
+
+    def blit(
+        self,
+        console: tcod.console.Console,
+        x: int,
+        y: int,
+        panel: str,
+        inputs: Hashable,
+        width: int,
+        height: int,
+        draw: Callable[[tcod.console.Console], None],
+    ) -> None:
+        """Draw the cached console of `panel` onto `console` at x, y."""
+        self.get(panel, inputs, width, height, draw).blit(console, x, y)
+
+    def invalidate(self, panel: str) -> None:
+        """Forget a panel, so it is drawn again the next time it is requested."""
+        self._panels.pop(panel, None)
+
+
+# Shared by every screen, these consoles are not part of the saved game.
+panel_cache = ConsoleCache()
@@ -2,14 +2,17 @@ from __future__ import annotations
 
 import lzma
 import pickle
-from typing import TYPE_CHECKING
+from typing import Optional, TYPE_CHECKING
 import time    # デバッグ記録用
 
+from tcod import libtcodpy
 from tcod.console import Console
 from tcod.map import compute_fov
+import tcod.path
 
 from message_log import MessageLog
 import render_functions
+from turn_scheduler import action_delay
 import exceptions   # 不可能な行動をengineで無効化する場合に必要、part9オリジナル修正
 
 if TYPE_CHECKING:
@@ -21,6 +24,17 @@ class Engine:
     game_map: GameMap
     game_world: GameWorld
 
+    # Names for the tcod FOV algorithms which `fov_algorithm` can be set to.
+    FOV_ALGORITHMS = {
+        "basic": libtcodpy.FOV_BASIC,
+        "restrictive": libtcodpy.FOV_RESTRICTIVE,
+        "shadowcasting": libtcodpy.FOV_SHADOW,
+        "symmetric": libtcodpy.FOV_SYMMETRIC_SHADOWCAST,
+    }
+
+    fov_radius = 8
+    fov_algorithm = "restrictive"
+
     def __init__(self, player: Actor):
         self.message_log = MessageLog()
         self.mouse_location = (0, 0)
@@ -35,45 +49,93 @@ class Engine:
         self.total_rooms = 0
         self.item_bonus_gold = 0
         # ---ここまで デバッグ記録用---
+        self._player_pathfinder: Optional[tcod.path.Pathfinder] = None
+
+    @property
+    def wake_radius(self) -> int:
+        """Parked monsters this close to the player wake up.
+
+        This covers the whole sight radius, so any monster the player can see is
+        awake.  It follows `fov_radius`, even when that is changed on an instance.
+        """
+        return self.fov_radius + 2
+
+    @property
+    def player_pathfinder(self) -> tcod.path.Pathfinder:
+        """A pathfinder rooted at the player, shared by all enemies for one turn.
+
+        The distance map is computed the first time an enemy asks for it during
+        `handle_enemy_turns` and is thrown away when the enemy turns end.
+        """
+        if self._player_pathfinder is None:
+            self._player_pathfinder = tcod.path.Pathfinder(self.game_map.path_graph)
+            self._player_pathfinder.add_root((self.player.x, self.player.y))
+            self._player_pathfinder.resolve()
+        return self._player_pathfinder
 
     def handle_enemy_turns(self) -> None:
-        for entity in set(self.game_map.actors) - {self.player}:
-            if entity.ai:
-               entity.ai.perform()  #この行を削除し下を有効にすれば不可能な行動全て無視する
+        self._player_pathfinder = None
+        try:
+            # Let every actor whose turn comes up during the players action act.
+            for entity in self.game_map.scheduler.advance(action_delay(self.player)):
+                if entity.ai:
+                    entity.ai.perform()  #この行を削除し下を有効にすれば不可能な行動全て無視する
 
-            """    try:
-                    entity.ai.perform()
-                except exceptions.Impossible:
-                    pass    # AIが不可能な行動をしても、単に無視して次の敵へ part9オリジナル修正
-            """
+                """    try:
+                        entity.ai.perform()
+                    except exceptions.Impossible:
+                        pass    # AIが不可能な行動をしても、単に無視して次の敵へ part9オリジナル修正
+                """
+        finally:
+            # The pathfinder can not be pickled and would go stale, so drop it.
+            self._player_pathfinder = None
 
     def update_fov(self) -> None:
-        """Recompute the visible area based on the players point of view."""
-        self.game_map.visible[:] = compute_fov(
-            self.game_map.tiles["transparent"],
-            (self.player.x, self.player.y),
-            radius=8,
+        """Recompute the visible area based on the players point of view.
+
+        Only the square of `fov_radius` tiles around the player is computed and
+        written, so the cost doesn't grow with the map size.
+
+        Nothing is done if the player position, the sight settings and the map
+        tiles are the same as the last time, such as after waiting or using an item.
+        """
+        game_map = self.game_map
+        x, y = self.player.x, self.player.y
+        radius = self.fov_radius
+        fov_key = (x, y, radius, self.fov_algorithm, game_map.version)
+        if game_map.fov_key == fov_key:
+            return
+        game_map.fov_key = fov_key
+
+        # Everything visible last time was inside of the previous window.
+        if game_map.fov_window:
+            x1, y1, x2, y2 = game_map.fov_window
+            game_map.visible[x1:x2, y1:y2] = False
+            game_map.mark_terrain_dirty(x1, y1, x2, y2)
+
+        x1, x2 = max(0, x - radius), min(game_map.width, x + radius + 1)
+        y1, y2 = max(0, y - radius), min(game_map.height, y + radius + 1)
+        game_map.fov_window = x1, y1, x2, y2
+        game_map.mark_terrain_dirty(x1, y1, x2, y2)
+
+        window_visible = compute_fov(
+            game_map.tiles["transparent"][x1:x2, y1:y2],
+            (x - x1, y - y1),
+            radius=radius,
+            algorithm=self.FOV_ALGORITHMS[self.fov_algorithm],
         )
+        game_map.visible[x1:x2, y1:y2] = window_visible
         # If a tile is "visible" it should be added to "explored".
-        self.game_map.explored |= self.game_map.visible
+        game_map.explored[x1:x2, y1:y2] |= window_visible
+
+        self.game_map.wake_actors_near(self.player.x, self.player.y, self.wake_radius)
             
     def render(self, console: Console) -> None:
         self.game_map.render(console)
 
         self.message_log.render(console=console, x=21, y=45, width=40, height=5)
 
-        render_functions.render_bar(
-            console=console,
-            current_value=self.player.fighter.hp,
-            maximum_value=self.player.fighter.max_hp,
-            total_width=20,
-        )
-
-        render_functions.render_dungeon_level(
-            console=console,
-            dungeon_level=self.game_world.current_floor,
-            location=(0, 47),
-        )
+        render_functions.render_status_panel(console=console, engine=self, location=(0, 45))
 
         render_functions.render_names_at_mouse_location(
             console=console, x=21, y=44, engine=self
@@ -83,4 +145,6 @@ class Engine:
         """Save this Engine instance as a compressed file."""
         save_data = lzma.compress(pickle.dumps(self))
         with open(filename, "wb") as f:
-            f.write(save_data)
\ No newline at end of file
+            f.write(save_data)
+        # Only this run's message history can be paged in from now on.
+        self.message_log.delete_other_spill_files()
\ No newline at end of file
@@ -47,7 +47,7 @@ class Entity:
         if parent:
             # If parent isn't provided now then it will be set later.
             self.parent = parent
-            parent.entities.add(self)
+            parent.add_entity(self)
 
     @property
     def gamemap(self) -> GameMap:
@@ -59,18 +59,24 @@ class Entity:
         clone.x = x
         clone.y = y
         clone.parent = gamemap
-        gamemap.entities.add(clone)
+        gamemap.add_entity(clone)
         return clone
 
     def place(self, x: int, y: int, gamemap: Optional[GameMap] = None) -> None:
         """Place this entity at a new location.  Handles moving across GameMaps."""
-        self.x = x
-        self.y = y
         if gamemap:
             if hasattr(self, "parent"):  # Possibly uninitialized.
                 if self.parent is self.gamemap:
-                    self.gamemap.entities.remove(self)
+                    self.gamemap.remove_entity(self)
+            self.x = x
+            self.y = y
             self.parent = gamemap
+            gamemap.add_entity(self)
+        elif hasattr(self, "parent") and self.parent is self.gamemap:
+            self.gamemap.relocate_entity(self, x, y)
+        else:
+            self.x = x
+            self.y = y
 
     def distance(self, x: int, y: int) -> float:
         """
@@ -80,8 +86,7 @@ class Entity:
 
     def move(self, dx: int, dy: int) -> None:
         # Move the entity by a given amount
-        self.x += dx
-        self.y += dy
+        self.gamemap.relocate_entity(self, self.x + dx, self.y + dy)
 
 
 class Actor(Entity):
@@ -98,6 +103,7 @@ class Actor(Entity):
         fighter: Fighter,
         inventory: Inventory,
         level: Level,
+        speed: int = 100,
     ):
         super().__init__(
             x=x,
@@ -125,6 +131,9 @@ class Actor(Entity):
 
         self.gold = 0  # 所持金を0で初期化
 
+        # 100 acts once per player turn at normal speed, 200 twice, 50 every other turn.
+        self.speed = speed
+
     @property
     def is_alive(self) -> bool:
         """Returns True as long as this actor can perform actions."""
@@ -0,0 +1,83 @@
+"""An on-disk cache of generated floor layouts, so a seeded floor is only built once.
+
+Only the layout is stored: the kind of every tile, the rooms and their links,
+and the records of the monsters and items.  Entities are spawned again from
+their prototypes on load, so changes to entity_factories are never served stale.
+"""
+from __future__ import annotations
+
+import hashlib
+import lzma
+import os
+import pickle
+from typing import Hashable, Optional, TYPE_CHECKING
+
+import numpy as np
+
+import tile_types
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from game_map import GameMap
+
+# One file per floor.  Files of old generator versions are never read again
+# and can be deleted at any time.
+FLOOR_CACHE_DIR = "floor_cache"
+
+# Bump this when the stored layout changes shape.
+FORMAT_VERSION = 1
+
+# Tiles are stored as indexes into this list.
+TILE_KINDS = [tile_types.wall, tile_types.floor, tile_types.down_stairs]
+
+
+def _path_for(key: Hashable) -> str:
+    digest = hashlib.sha1(repr((FORMAT_VERSION, key)).encode()).hexdigest()[:20]
+    return os.path.join(FLOOR_CACHE_DIR, f"{digest}.floor")
+
+
+def load(key: Hashable, engine: Engine) -> Optional[GameMap]:
+    """Return the floor stored under `key`, or None if there is no usable one."""
+    from procgen import restore_dungeon
+
+    try:
+        with open(_path_for(key), "rb") as f:
+            stored_key, layout = pickle.loads(lzma.decompress(f.read()))
+    except Exception:
+        return None  # Missing, broken or unreadable floors are generated again.
+    if stored_key != key:
+        return None  # A digest collision, which is as good as a miss.
+
+    tiles = np.full(layout["tile_kinds"].shape, fill_value=tile_types.wall, order="F")
+    for index, kind in enumerate(TILE_KINDS):
+        tiles[layout["tile_kinds"] == index] = kind
+    return restore_dungeon(engine, tiles, layout)
+
+
+def store(key: Hashable, dungeon: GameMap) -> None:
+    """Store the layout of a freshly built floor under `key`.  Failing to write is ignored."""
+    tile_kinds = np.zeros((dungeon.width, dungeon.height), dtype=np.int8, order="F")
+    for index, kind in enumerate(TILE_KINDS):
+        tile_kinds[dungeon.tiles == kind] = index
+    layout = {
+        "tile_kinds": tile_kinds,
+        "rooms": [(room.x1, room.y1, room.x2, room.y2) for room in dungeon.rooms],
+        "room_links": dungeon.room_links,
+        "spawn_records": {
+            room: [tuple(record) for record in records]
+            for room, records in dungeon.spawn_records.items()
+        },
+        "item_records": [tuple(record) for record in dungeon.item_records],
+        "downstairs_location": dungeon.downstairs_location,
+        "entry_location": dungeon.entry_location,
+    }
+    path = _path_for(key)
+    try:
+        os.makedirs(FLOOR_CACHE_DIR, exist_ok=True)
+        # Write to a temporary file first, so a reader never sees half a floor.
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(lzma.compress(pickle.dumps((key, layout), protocol=pickle.HIGHEST_PROTOCOL)))
+        os.replace(temporary_path, path)
+    except OSError:
+        pass
@@ -1,25 +1,71 @@
 from __future__ import annotations
 
-from typing import Iterable, Iterator, Optional, TYPE_CHECKING
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import random
+from typing import Dict, Iterable, KeysView, List, NamedTuple, Optional, Sequence, Set, Tuple, TYPE_CHECKING
 
 import numpy as np  # type: ignore
 from tcod.console import Console
+import tcod.path
 
 from entity import Actor, Item
+from render_order import RenderOrder
+from rng_streams import run_stream
 import tile_types
+from turn_scheduler import TurnScheduler
 
 if TYPE_CHECKING:
     from engine import Engine
     from entity import Entity
+    from procgen import RectangularRoom
+
+
+class SpawnRecord(NamedTuple):
+    """A monster which hasn't been created yet, see GameMap.materialize_room."""
+
+    prototype: str  # Key into procgen.monster_prototypes.
+    x: int
+    y: int
+
+
+class ItemRecord(NamedTuple):
+    """How an item of a floor was rolled, so the floor cache can spawn it again."""
+
+    prototype: str  # Key into procgen.item_prototypes.
+    x: int
+    y: int
+    bonus: int  # The amount of gold, or the power bonus of a weapon.
 
 
 class GameMap:
+    # Layers with at least this many visible entities are drawn with one NumPy
+    # scatter, smaller ones are cheaper to write glyph by glyph.
+    BULK_DRAW_MINIMUM = 20
+
     def __init__(
         self, engine: Engine, width: int, height: int, entities: Iterable[Entity] = ()
     ):
         self.engine = engine
         self.width, self.height = width, height
-        self.entities = set(entities)
+        self.entities: Set[Entity] = set()
+        # Per-tile buckets of entities, kept in sync by add/remove/relocate_entity.
+        self._entities_by_location: Dict[Tuple[int, int], List[Entity]] = {}
+        # Typed registries, in insertion order.  Dicts are used as ordered sets.
+        self._living_actors: Dict[Actor, None] = {}
+        self._corpses: Dict[Actor, None] = {}
+        self._items: Dict[Item, None] = {}
+        # Decides when the living actors other than the player take their turns.
+        self.scheduler = TurnScheduler()
+        # Living actors parked out of the scheduler until something wakes them.
+        self._dormant: Dict[Actor, None] = {}
+        # Entities whose blocking penalty is part of the path cost array.
+        self._blockers: Set[Entity] = set()
+        # Built on first use, once the floor has been carved.  See path_cost.
+        self._path_cost: Optional[np.ndarray] = None
+        self._path_graph: Optional[tcod.path.SimpleGraph] = None
+        for entity in entities:
+            self.add_entity(entity)
         self.tiles = np.full((width, height), fill_value=tile_types.wall, order="F")
 
         self.visible = np.full(
@@ -30,48 +76,313 @@ class GameMap:
         )  # Tiles the player has seen before
 
         self.downstairs_location = (0, 0)
+        # Where the player is put when arriving on this floor.
+        self.entry_location = (0, 0)
+
+        # The room/corridor graph, filled in by procgen.
+        self.rooms: List[RectangularRoom] = []
+        # Index of the room whose inner area holds each tile, -1 for corridors and walls.
+        self.room_ids = np.full((width, height), fill_value=-1, dtype=np.int16, order="F")
+        # Room indexes joined by a tunnel.
+        self.room_links: Dict[int, List[int]] = {}
+        # Monsters of rooms the player hasn't come near yet, by room index.
+        self.spawn_records: Dict[int, List[SpawnRecord]] = {}
+        # The items procgen placed, read by the floor cache when the floor is built.
+        self.item_records: List[ItemRecord] = []
+
+        # Bumped by tiles_changed, lets caches built from the tiles notice edits.
+        self.version = 0
+        # The player position, sight settings and version the visible array was
+        # last computed for, and the (x1, y1, x2, y2) window it was written to.
+        self.fov_key: Optional[Tuple[int, int, int, str, int]] = None
+        self.fov_window: Optional[Tuple[int, int, int, int]] = None
+
+        # The composited terrain graphics, see render.  None means rebuild it all.
+        self._terrain: Optional[np.ndarray] = None
+        # (x1, y1, x2, y2) of the tiles which changed since the last render.
+        self._terrain_dirty: Optional[Tuple[int, int, int, int]] = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        # The graph can not be pickled, the cost array is cheap to rebuild.
+        state["_path_cost"] = None
+        state["_path_graph"] = None
+        state["_terrain"] = None
+        return state
 
     @property
     def gamemap(self) -> GameMap:
         return self
 
     @property
-    def actors(self) -> Iterator[Actor]:
-        """Iterate over this maps living actors."""
-        yield from (
-            entity
-            for entity in self.entities
-            if isinstance(entity, Actor) and entity.is_alive
-        )
-    
+    def actors(self) -> KeysView[Actor]:
+        """This maps living actors.
+
+        This is a live view, take a copy before killing actors while iterating it.
+        """
+        return self._living_actors.keys()
+
+    @property
+    def corpses(self) -> KeysView[Actor]:
+        """The actors on this map which have died."""
+        return self._corpses.keys()
+
     @property
-    def items(self) -> Iterator[Item]:
-        yield from (entity for entity in self.entities if isinstance(entity, Item))
+    def items(self) -> KeysView[Item]:
+        """The items lying on this map."""
+        return self._items.keys()
+
+    def add_entity(self, entity: Entity) -> None:
+        """Add an entity to this map and index it at its current location."""
+        registry = self._registry_for(entity)
+        if registry is not None:
+            registry[entity] = None
+        self.entities.add(entity)
+        self._entities_by_location.setdefault((entity.x, entity.y), []).append(entity)
+        if entity in self._living_actors and entity is not self.engine.player:
+            self.scheduler.add(entity)
+        if entity.blocks_movement:
+            self._blockers.add(entity)
+            self._add_blocker_cost(entity.x, entity.y, 1)
+
+    def remove_entity(self, entity: Entity) -> None:
+        """Remove an entity from this map and from its location bucket."""
+        registry = self._registry_for(entity)
+        if registry is not None:
+            del registry[entity]
+        self.entities.remove(entity)
+        self._unindex(entity)
+        self.scheduler.remove(entity)
+        self._dormant.pop(entity, None)
+        if entity in self._blockers:
+            self._blockers.remove(entity)
+            self._add_blocker_cost(entity.x, entity.y, -1)
+
+    def mark_dead(self, actor: Actor) -> None:
+        """Move an actor which has just died from the living actors to the corpses."""
+        del self._living_actors[actor]
+        self._corpses[actor] = None
+        self.scheduler.remove(actor)
+        self._dormant.pop(actor, None)
+        if actor in self._blockers:
+            self._blockers.remove(actor)
+            self._add_blocker_cost(actor.x, actor.y, -1)
+
+    @property
+    def dormant_actors(self) -> KeysView[Actor]:
+        """Living actors which are parked and don't take turns."""
+        return self._dormant.keys()
+
+    def park(self, actor: Actor) -> None:
+        """Stop giving this actor turns until it is woken up."""
+        if actor in self._living_actors:
+            self.scheduler.remove(actor)
+            self._dormant[actor] = None
+
+    def wake(self, actor: Actor) -> None:
+        """Give a parked actor turns again."""
+        if actor in self._dormant:
+            del self._dormant[actor]
+            self.scheduler.add(actor)
+
+    def wake_actors_near(self, x: int, y: int, radius: int) -> None:
+        """Wake the parked actors within `radius` tiles of a location.
+
+        Used for the player coming close and for noise.  The cost is bounded by
+        the smaller of the number of parked actors and the size of the area.
+        Rooms in range which still hold spawn records are materialized first.
+        """
+        for room_index in list(self.spawn_records):
+            room = self.rooms[room_index]
+            # Chebyshev distance from the location to the room.
+            room_distance = max(room.x1 - x, x - room.x2, room.y1 - y, y - room.y2, 0)
+            if room_distance <= radius:
+                self.materialize_room(room_index)
+
+        if not self._dormant:
+            return
+        if len(self._dormant) < (2 * radius + 1) ** 2:
+            for actor in list(self._dormant):
+                if max(abs(actor.x - x), abs(actor.y - y)) <= radius:
+                    self.wake(actor)
+        else:
+            for tile_x in range(x - radius, x + radius + 1):
+                for tile_y in range(y - radius, y + radius + 1):
+                    for entity in self._entities_by_location.get((tile_x, tile_y), ()):
+                        if entity in self._dormant:
+                            self.wake(entity)  # type: ignore[arg-type]
+
+    def materialize_room(self, room_index: int) -> None:
+        """Create the monsters recorded for a room.  They start out parked."""
+        from procgen import monster_prototypes
+
+        for record in self.spawn_records.pop(room_index, ()):
+            x, y = record.x, record.y
+            if self.get_blocking_entity_at_location(x, y):
+                # Something wandered onto this spot, use any free tile in the room.
+                room_x, room_y = self.rooms[room_index].inner
+                free = [
+                    (free_x, free_y)
+                    for free_x in range(room_x.start, room_x.stop)
+                    for free_y in range(room_y.start, room_y.stop)
+                    if not self.get_blocking_entity_at_location(free_x, free_y)
+                ]
+                if not free:
+                    continue
+                x, y = free[0]
+            self.park(monster_prototypes[record.prototype].spawn(self, x, y))
+
+    def _registry_for(self, entity: Entity) -> Optional[Dict]:
+        if isinstance(entity, Actor):
+            return self._living_actors if entity.is_alive else self._corpses
+        if isinstance(entity, Item):
+            return self._items
+        return None  # Plain entities are only tracked by location.
+
+    def relocate_entity(self, entity: Entity, x: int, y: int) -> None:
+        """Move an entity already on this map to a new location."""
+        self._unindex(entity)
+        if entity in self._blockers:
+            self._add_blocker_cost(entity.x, entity.y, -1)
+            self._add_blocker_cost(x, y, 1)
+        entity.x = x
+        entity.y = y
+        self._entities_by_location.setdefault((x, y), []).append(entity)
+
+    def _unindex(self, entity: Entity) -> None:
+        location = (entity.x, entity.y)
+        bucket = self._entities_by_location[location]
+        bucket.remove(entity)
+        if not bucket:
+            del self._entities_by_location[location]
+
+    def get_entities_at_location(self, x: int, y: int) -> Sequence[Entity]:
+        """Return the entities standing on the given tile."""
+        return self._entities_by_location.get((x, y), ())
 
     def get_blocking_entity_at_location(
         self, location_x: int, location_y: int,
     ) -> Optional[Entity]:
-        for entity in self.entities:
-            if (
-                entity.blocks_movement
-                and entity.x == location_x
-                and entity.y == location_y
-            ):
-                 return entity
+        for entity in self.get_entities_at_location(location_x, location_y):
+            if entity.blocks_movement:
+                return entity
 
         return None
 
     def get_actor_at_location(self, x: int, y: int) -> Optional[Actor]:
-        for actor in self.actors:
-            if actor.x == x and actor.y == y:
-                return actor
+        for entity in self.get_entities_at_location(x, y):
+            if isinstance(entity, Actor) and entity.is_alive:
+                return entity
 
         return None
 
+    @property
+    def path_cost(self) -> np.ndarray:
+        """The movement cost array used for pathfinding over this map.
+
+        Walls cost 0 (impassable), floors cost 1 and tiles holding a blocking
+        entity have an extra penalty.  The array is built once and then kept up
+        to date as blocking entities move, die or leave the map.
+        """
+        if self._path_cost is None:
+            # Copy the walkable array.
+            self._path_cost = np.array(self.tiles["walkable"], dtype=np.int8)
+            for entity in self._blockers:
+                self._add_blocker_cost(entity.x, entity.y, 1)
+        return self._path_cost
+
+    @property
+    def path_graph(self) -> tcod.path.SimpleGraph:
+        """A graph over `path_cost` which pathfinders can reuse.
+
+        The graph reads the cost array in place, so it sees blocker updates.
+        """
+        if self._path_graph is None:
+            self._path_graph = tcod.path.SimpleGraph(
+                cost=self.path_cost, cardinal=2, diagonal=3
+            )
+        return self._path_graph
+
+    def tiles_changed(self) -> None:
+        """Call after editing `tiles` once the floor is in play.
+
+        Bumps the map version, which makes the FOV and AI paths get recomputed,
+        and drops the cached path cost and graph.
+        """
+        self.version += 1
+        self._path_cost = None
+        self._path_graph = None
+        self._terrain = None
+
+    def _add_blocker_cost(self, x: int, y: int, direction: int) -> None:
+        """Apply (direction=1) or revert (direction=-1) a blocking penalty."""
+        # Check that the cost isn't zero (blocking) and the array has been built.
+        if self._path_cost is not None and self.tiles["walkable"][x, y]:
+            # Add to the cost of a blocked position.
+            # A lower number means more enemies will crowd behind each other in
+            # hallways.  A higher number means enemies will take longer paths in
+            # order to surround the player.
+            self._path_cost[x, y] += 10 * direction
+
+    def add_room(self, room: RectangularRoom) -> int:
+        """Record a carved room and return its index."""
+        index = len(self.rooms)
+        self.rooms.append(room)
+        self.room_ids[room.inner] = index
+        self.room_links[index] = []
+        return index
+
+    def link_rooms(self, first: int, second: int) -> None:
+        """Record that a tunnel joins these two rooms."""
+        self.room_links[first].append(second)
+        self.room_links[second].append(first)
+
+    def get_room_at(self, x: int, y: int) -> Optional[int]:
+        """Return the index of the room at this location, or None if outside of a room."""
+        index = int(self.room_ids[x, y])
+        return index if index >= 0 else None
+
+    def find_room_route(self, start: int, goal: int) -> List[int]:
+        """Return the room indexes from `start` to `goal` with the fewest tunnels.
+
+        The route includes both ends.  An empty list means the rooms aren't linked.
+        """
+        came_from: Dict[int, Optional[int]] = {start: None}
+        frontier = deque([start])
+        while frontier:
+            current = frontier.popleft()
+            if current == goal:
+                break
+            for neighbor in self.room_links[current]:
+                if neighbor not in came_from:
+                    came_from[neighbor] = current
+                    frontier.append(neighbor)
+        else:
+            return []
+
+        route: List[int] = []
+        step: Optional[int] = goal
+        while step is not None:
+            route.append(step)
+            step = came_from[step]
+        route.reverse()
+        return route
+
     def in_bounds(self, x: int, y: int) -> bool:
         """Return True if x and y are inside of the bounds of this map."""
         return 0 <= x < self.width and 0 <= y < self.height
 
+    def mark_terrain_dirty(self, x1: int, y1: int, x2: int, y2: int) -> None:
+        """Note that `visible` or `explored` changed inside of this area.
+
+        `x2` and `y2` are exclusive.  The area is redrawn on the next render.
+        """
+        if self._terrain_dirty:
+            old_x1, old_y1, old_x2, old_y2 = self._terrain_dirty
+            x1, y1 = min(x1, old_x1), min(y1, old_y1)
+            x2, y2 = max(x2, old_x2), max(y2, old_y2)
+        self._terrain_dirty = x1, y1, x2, y2
+
     def render(self, console: Console) -> None:
         """
         Renders the map.
@@ -79,22 +390,76 @@ class GameMap:
         If a tile is in the "visible" array, then draw it with the "light" colors.
         If it isn't, but it's in the "explored" array, then draw it with the "dark" colors.
         Otherwise, the default is "SHROUD".
-        """
-        console.rgb[0 : self.width, 0 : self.height] = np.select(
-            condlist=[self.visible, self.explored],
-            choicelist=[self.tiles["light"], self.tiles["dark"]],
-            default=tile_types.SHROUD,
-        )
 
-        entities_sorted_for_rendering = sorted(
-            self.entities, key=lambda x: x.render_order.value
-        )
-        for entity in entities_sorted_for_rendering:
-            # Only print entities that are in the FOV
-            if self.visible[entity.x, entity.y]:
-                console.print(
-                    x=entity.x, y=entity.y, string=entity.char, fg=entity.color
-                )
+        The result is kept between frames and only the area passed to
+        `mark_terrain_dirty` is composited again.
+        """
+        if self._terrain is None:
+            self._terrain = np.full(
+                (self.width, self.height), fill_value=tile_types.SHROUD, order="F"
+            )
+            self._terrain_dirty = 0, 0, self.width, self.height
+        if self._terrain_dirty:
+            x1, y1, x2, y2 = self._terrain_dirty
+            self._terrain[x1:x2, y1:y2] = np.select(
+                condlist=[self.visible[x1:x2, y1:y2], self.explored[x1:x2, y1:y2]],
+                choicelist=[
+                    self.tiles["light"][x1:x2, y1:y2],
+                    self.tiles["dark"][x1:x2, y1:y2],
+                ],
+                default=tile_types.SHROUD,
+            )
+            self._terrain_dirty = None
+        console.rgb[0 : self.width, 0 : self.height] = self._terrain
+
+        self.render_entities(console)
+
+    def render_entities(self, console: Console) -> None:
+        """Draw the entities on visible tiles, higher render orders on top.
+
+        Only the occupied tiles or the tiles of the current FOV window are looked
+        at, whichever are fewer, and the glyphs of each render order are written
+        into the console in one go.
+        """
+        if not self.fov_window:
+            return
+        x1, y1, x2, y2 = self.fov_window
+
+        layers: Dict[RenderOrder, List[Entity]] = {order: [] for order in RenderOrder}
+        if len(self._entities_by_location) < (x2 - x1) * (y2 - y1):
+            for (x, y), bucket in self._entities_by_location.items():
+                if x1 <= x < x2 and y1 <= y < y2 and self.visible[x, y]:
+                    for entity in bucket:
+                        layers[entity.render_order].append(entity)
+        else:
+            for x, y in np.argwhere(self.visible[x1:x2, y1:y2]).tolist():
+                for entity in self._entities_by_location.get((x + x1, y + y1), ()):
+                    layers[entity.render_order].append(entity)
+
+        rgb = console.rgb
+        chars, colors = rgb["ch"], rgb["fg"]
+        # RenderOrder members are listed from the bottom layer to the top one.
+        for entities in layers.values():
+            if len(entities) < self.BULK_DRAW_MINIMUM:
+                for entity in entities:
+                    chars[entity.x, entity.y] = ord(entity.char)
+                    colors[entity.x, entity.y] = entity.color
+                continue
+            xs = [entity.x for entity in entities]
+            ys = [entity.y for entity in entities]
+            chars[xs, ys] = [ord(entity.char) for entity in entities]
+            colors[xs, ys] = [entity.color for entity in entities]
+
+
+class FloorSettings(NamedTuple):
+    """The inputs a floor is generated from."""
+
+    floor: int
+    max_rooms: int
+    room_min_size: int
+    room_max_size: int
+    map_width: int
+    map_height: int
 
 
 class GameWorld:
@@ -111,10 +476,20 @@ class GameWorld:
         max_rooms: int,
         room_min_size: int,
         room_max_size: int,
-        current_floor: int = 0
+        current_floor: int = 0,
+        seed: Optional[int] = None,
     ):
         self.engine = engine
 
+        # Every floor of a run is generated from this, see rng_streams.
+        self.seed = random.getrandbits(64) if seed is None else seed
+        # Built floors are read from and written to the floor cache only for
+        # runs with a chosen seed, such as replays and benchmarks.  A random
+        # seed is never seen again, so caching its floors would only cost time.
+        self.use_floor_cache = seed is not None
+        # Random stream of the monster AI, such as where confused monsters stumble.
+        self.ai_rng = run_stream(self.seed, "ai")
+
         self.map_width = map_width
         self.map_height = map_height
 
@@ -125,16 +500,25 @@ class GameWorld:
 
         self.current_floor = current_floor
 
-    def generate_floor(self) -> None:
-        from procgen import generate_dungeon, max_rooms_by_floor, get_max_rooms_for_floor
+        # The settings the next floor is being built for and the pending build.
+        self._pregenerated: Optional[Tuple[FloorSettings, Future[GameMap]]] = None
 
-        self.current_floor += 1
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        # A pending pregeneration can't be saved, the next floor is generated
+        # synchronously after loading instead.
+        state["_pregenerated"] = None
+        return state
+
+    def floor_settings(self, floor: int) -> FloorSettings:
+        """Return everything the generation of `floor` depends on."""
+        from procgen import get_floor_limits
 
         # --- マップサイズの動的計算 ---
         # 1階を (width: 40, height: 25) とし、1階ごとに幅+2、高さ+1 する例
         # min/maxを使って、小さすぎず、画面からはみ出さないサイズに制限します
-        dynamic_width = max(20, min(80, 40 + (self.current_floor * 2)))
-        dynamic_height = max(20, min(43, 25 + self.current_floor))
+        dynamic_width = max(20, min(80, 40 + (floor * 2)))
+        dynamic_height = max(20, min(43, 25 + floor))
 
 
         # --- ここで部屋数を計算 ---
@@ -143,15 +527,81 @@ class GameWorld:
         # dynamic_max_rooms = 6 + (self.current_floor * 2) # 階層ごとの管理の前の計算方法
 
         # 現在の階層に応じた部屋数を取得 階層ごとの管理方式
-        dynamic_max_rooms = get_max_rooms_for_floor(
-            max_rooms_by_floor, self.current_floor
-        )
+        dynamic_max_rooms = get_floor_limits(floor).max_rooms
 
-        self.engine.game_map = generate_dungeon(
+        return FloorSettings(
+            floor=floor,
             max_rooms=dynamic_max_rooms,    # 計算した値を渡す
             room_min_size=self.room_min_size,
             room_max_size=self.room_max_size,
             map_width=dynamic_width, # 動的な幅
             map_height=dynamic_height, # 動的な高さ
-            engine=self.engine,
-        )
\ No newline at end of file
+        )
+
+    def build_floor(self, settings: FloorSettings) -> GameMap:
+        """Build the map of a floor without putting the player in it.
+
+        Floors are deterministic, so they are loaded from the floor cache when
+        this seed and generator version built the same floor before.
+        """
+        import floor_cache
+        from procgen import GENERATOR_VERSION, build_dungeon
+        from rng_streams import floor_streams
+
+        key = (self.seed, settings, GENERATOR_VERSION)
+        dungeon = floor_cache.load(key, self.engine) if self.use_floor_cache else None
+        if dungeon is None:
+            dungeon = build_dungeon(
+                max_rooms=settings.max_rooms,
+                room_min_size=settings.room_min_size,
+                room_max_size=settings.room_max_size,
+                map_width=settings.map_width,
+                map_height=settings.map_height,
+                engine=self.engine,
+                floor_number=settings.floor,
+                streams=floor_streams(self.seed, settings.floor),
+            )
+            if self.use_floor_cache:
+                floor_cache.store(key, dungeon)
+            dungeon.item_records = []
+        return dungeon
+
+    def pregenerate_next_floor(self) -> None:
+        """Start building the floor below the current one in a worker thread."""
+        settings = self.floor_settings(self.current_floor + 1)
+        future = _get_pregeneration_executor().submit(self.build_floor, settings)
+        self._pregenerated = (settings, future)
+
+    def generate_floor(self) -> None:
+        from procgen import enter_dungeon
+
+        self.current_floor += 1
+        settings = self.floor_settings(self.current_floor)
+
+        dungeon: Optional[GameMap] = None
+        if self._pregenerated is not None:
+            pregenerated_settings, future = self._pregenerated
+            self._pregenerated = None
+            if pregenerated_settings == settings:
+                dungeon = future.result()  # Normally finished long before the stairs.
+            else:
+                future.cancel()  # Built for other settings, it can't be used.
+        if dungeon is None:
+            dungeon = self.build_floor(settings)
+
+        enter_dungeon(dungeon, self.engine)
+        self.engine.game_map = dungeon
+        self.pregenerate_next_floor()
+
+
+def _get_pregeneration_executor() -> ThreadPoolExecutor:
+    global _pregeneration_executor
+    if _pregeneration_executor is None:
+        _pregeneration_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="pregenerate"
+        )
+    return _pregeneration_executor
+
+
+# Builds upcoming floors, see GameWorld.pregenerate_next_floor.
+_pregeneration_executor: Optional[ThreadPoolExecutor] = None
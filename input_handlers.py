@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import bisect
 import os
 
 from typing import Callable, Optional, Tuple, TYPE_CHECKING, Union
@@ -15,6 +16,7 @@ from actions import (
     WaitAction
 )
 import color
+from console_cache import panel_cache
 import exceptions
 
 if TYPE_CHECKING:
@@ -74,14 +76,39 @@ MainGameEventHandler will become the active handler.
 
 
 class BaseEventHandler(tcod.event.EventDispatch[ActionOrHandler]):
+    # Set when something this handler draws may have changed.  The main loop
+    # only renders a frame when this is set or the active handler changed.
+    redraw = True
+
     def handle_events(self, event: tcod.event.Event) -> BaseEventHandler:
         """Handle an event and return the next active event handler."""
+        self.note_event(event)
         state = self.dispatch(event)
         if isinstance(state, BaseEventHandler):
             return state
         assert not isinstance(state, Action), f"{self!r} can not handle actions."
         return self
 
+    def note_event(self, event: tcod.event.Event) -> None:
+        """Mark this handler for a redraw if the event may change the screen.
+
+        Mouse motion is left to the handlers which show something for it.
+        """
+        if not isinstance(event, tcod.event.MouseMotion):
+            self.redraw = True
+
+    def needs_redraw(self) -> bool:
+        """Return True if the screen is out of date with this handler."""
+        return self.redraw
+
+    def mark_drawn(self) -> None:
+        """Called by the main loop after a frame of this handler was presented."""
+        self.redraw = False
+
+    def wants_text_input(self) -> bool:
+        """Return True while this handler reads typed text from ev_textinput."""
+        return False
+
     def on_render(self, console: tcod.Console) -> None:
         raise NotImplementedError()
 
@@ -119,9 +146,12 @@ class PopupMessage(BaseEventHandler):
 class EventHandler(BaseEventHandler):
     def __init__(self, engine: Engine):
         self.engine = engine
+        # The message log version shown by the last presented frame.
+        self.drawn_log_version = -1
     
     def handle_events(self, event: tcod.event.Event) -> BaseEventHandler:
         """Handle events for input handlers with an engine."""
+        self.note_event(event)
         action_or_state = self.dispatch(event)
         if isinstance(action_or_state, BaseEventHandler):
             return action_or_state
@@ -172,11 +202,24 @@ class EventHandler(BaseEventHandler):
         self.engine.update_fov()
         return True
 
+    def needs_redraw(self) -> bool:
+        return (
+            super().needs_redraw()
+            or self.engine.message_log.version != self.drawn_log_version
+        )
+
+    def mark_drawn(self) -> None:
+        super().mark_drawn()
+        self.drawn_log_version = self.engine.message_log.version
+
     def ev_mousemotion(self, event: tcod.event.MouseMotion) -> None:
         x = int(event.tile.x)   #part7から離れたオリジナルの変更
         y = int(event.tile.y)   #part7から離れたオリジナルの変更
         
         if self.engine.game_map.in_bounds(x, y):    #part7から離れたオリジナルの変更
+            if self.engine.mouse_location != (x, y):
+                # The names under the mouse are shown, so hovering a new tile redraws.
+                self.redraw = True
             self.engine.mouse_location = x, y       #part7から離れたオリジナルの変更
 
     def on_render(self, console: tcod.Console) -> None:
@@ -614,6 +657,7 @@ class GameOverEventHandler(EventHandler):
         """Handle exiting out of a finished game."""
         if os.path.exists("savegame.sav"):
             os.remove("savegame.sav")  # Deletes the active save file.
+        self.engine.message_log.delete_spill_file()
         raise exceptions.QuitWithoutSaving()  # Avoid saving a finished game.
 
     def ev_quit(self, event: tcod.event.Quit) -> None:
@@ -650,6 +694,7 @@ class GameOverEventHandler(EventHandler):
             
             if os.path.exists("savegame.sav"):
                 os.remove("savegame.sav")
+            self.engine.message_log.delete_spill_file()
             
             # メインメニューへ戻る
             return setup_game.MainMenu()
@@ -734,38 +779,105 @@ CURSOR_Y_KEYS = {
 
 
 class HistoryViewer(EventHandler):
-    """Print the history on a larger window which can be navigated."""
+    """Print the history on a larger window which can be navigated.
+
+    Press "/" to search the whole history, the cursor jumps to the newest match
+    as the text is typed.  Enter jumps to the next older match, Escape ends
+    the search.
+    """
 
     def __init__(self, engine: Engine):
         super().__init__(engine)
-        self.log_length = len(engine.message_log.messages)
+        self.log_length = len(engine.message_log)
         self.cursor = self.log_length - 1
+        # The text being searched for, or None when not searching.
+        self.search: Optional[str] = None
+        self.search_origin = self.cursor
+        self.search_failed = False
 
     def on_render(self, console: tcod.Console) -> None:
         super().on_render(console)  # Draw the main state as the background.
 
-        log_console = tcod.console.Console(console.width - 6, console.height - 6)
+        # The window only changes when the cursor moves or a message is logged.
+        panel_cache.blit(
+            console,
+            3,
+            3,
+            "history",
+            (
+                self.engine.message_log,
+                self.engine.message_log.version,
+                self.cursor,
+                self.search,
+                self.search_failed,
+            ),
+            console.width - 6,
+            console.height - 6,
+            self.draw_history,
+        )
 
+    def draw_history(self, log_console: tcod.Console) -> None:
         # Draw a frame with a custom banner title.
         log_console.draw_frame(0, 0, log_console.width, log_console.height)
         log_console.print_box(
             0, 0, log_console.width, 1, "┤Message history├", alignment=libtcodpy.CENTER
         )
 
-        # Render the message log using the cursor parameter.
+        # Render the message log using the cursor parameter.  The line index
+        # tells which messages reach into the window, only those are paged in.
+        width = log_console.width - 2
+        height = log_console.height - 2
+        offsets = self.engine.message_log.line_offsets(width)
+        window_top = max(0, offsets[self.cursor + 1] - height)
+        first = max(0, bisect.bisect_right(offsets, window_top) - 1)
         self.engine.message_log.render_messages(
             log_console,
             1,
             1,
-            log_console.width - 2,
-            log_console.height - 2,
-            self.engine.message_log.messages[: self.cursor + 1],
+            width,
+            height,
+            self.engine.message_log.get_messages(first, self.cursor + 1),
         )
-        log_console.blit(console, 3, 3)
+
+        if self.search is not None:
+            prompt = f"┤/{self.search}_{' (not found)' if self.search_failed else ''}├"
+            log_console.print(x=1, y=log_console.height - 1, string=prompt)
+
+    def jump_to_match(self, start: int) -> None:
+        """Move the cursor to the newest match of the search at or before `start`."""
+        assert self.search is not None
+        match = self.engine.message_log.search(self.search, start) if self.search else None
+        self.search_failed = bool(self.search) and match is None
+        if match is not None:
+            self.cursor = match
+
+    def on_search_key(self, event: tcod.event.KeyDown) -> None:
+        assert self.search is not None
+        if event.sym == tcod.event.KeySym.ESCAPE:
+            self.search = None  # Leave the search, staying on the match.
+            self.search_failed = False
+        elif event.sym in CONFIRM_KEYS:
+            if self.log_length:
+                self.jump_to_match((self.cursor - 1) % self.log_length)
+        elif event.sym == tcod.event.KeySym.BACKSPACE:
+            self.search = self.search[:-1]
+            self.jump_to_match(self.search_origin)
+        # Typed characters arrive through ev_textinput, other keys are ignored.
+
+    def wants_text_input(self) -> bool:
+        return self.search is not None
+
+    def ev_textinput(self, event: tcod.event.TextInput) -> None:
+        # The text is what the keyboard layout and modifiers produce, like "+".
+        if self.search is not None:
+            self.search += event.text
+            self.jump_to_match(self.search_origin)
 
     def ev_keydown(self, event: tcod.event.KeyDown) -> Optional[MainGameEventHandler]:
+        if self.search is not None and event.sym not in CURSOR_Y_KEYS:
+            self.on_search_key(event)
         # Fancy conditional movement to make it feel right.
-        if event.sym in CURSOR_Y_KEYS:
+        elif event.sym in CURSOR_Y_KEYS:
             adjust = CURSOR_Y_KEYS[event.sym]
             if adjust < 0 and self.cursor == 0:
                 # Only move from the top to the bottom when you're on the edge.
@@ -780,6 +892,9 @@ class HistoryViewer(EventHandler):
             self.cursor = 0  # Move directly to the top message.
         elif event.sym == tcod.event.KeySym.END:
             self.cursor = self.log_length - 1  # Move directly to the last message.
+        elif event.sym == tcod.event.KeySym.SLASH:
+            self.search = ""  # Start a search from the current message.
+            self.search_origin = self.cursor
         else:  # Any other key moves back to the main game state.
             return MainGameEventHandler(self.engine)
         return None
@@ -791,6 +906,20 @@ class RankingEventHandler(BaseEventHandler):
         self.latest_score = latest_score # 最新のスコアを保持
 
     def on_render(self, console: tcod.console.Console) -> None:
+        import score_utils
+        # 表は一度だけ読み込んで整形し、スコアファイルが変わった時だけ作り直す
+        panel_cache.blit(
+            console,
+            0,
+            0,
+            "ranking",
+            (score_utils.scores_signature(), repr(self.latest_score)),
+            console.width,
+            console.height,
+            self.draw_table,
+        )
+
+    def draw_table(self, console: tcod.console.Console) -> None:
         import score_utils
         scores = score_utils.load_scores()
 
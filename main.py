@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import traceback
+from typing import Optional
 
 import tcod
 
@@ -34,16 +35,29 @@ def main() -> None:
         vsync=True,
     ) as context:
         root_console = tcod.console.Console(screen_width, screen_height, order="F")
+        drawn_handler: Optional[input_handlers.BaseEventHandler] = None
+        text_input = False
         try:
             while True:
-                root_console.clear()
-                handler.on_render(console=root_console)
-                context.present(root_console)
+                # Only draw when the handler changed or says its screen is stale.
+                if handler is not drawn_handler or handler.needs_redraw():
+                    root_console.clear()
+                    handler.on_render(console=root_console)
+                    context.present(root_console)
+                    handler.mark_drawn()
+                    drawn_handler = handler
 
                 try:
                     for event in tcod.event.wait():
                         context.convert_event(event)
                         handler = handler.handle_events(event)
+                        # SDL only sends TextInput events while text input is started.
+                        if handler.wants_text_input() != text_input and context.sdl_window:
+                            text_input = handler.wants_text_input()
+                            if text_input:
+                                context.sdl_window.start_text_input()
+                            else:
+                                context.sdl_window.stop_text_input()
                 except Exception:  # Handle exceptions in game.
                     traceback.print_exc()  # Print error to stderr.
                     # Then print the error to the message log.
@@ -1,9 +1,17 @@
-from typing import Iterable, List, Reversible, Tuple
+from array import array
+from collections import deque
+from itertools import islice
+import json
+import os
+import time
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Reversible, Tuple
 import textwrap
+import uuid
 
 import tcod
 
 import color
+from console_cache import panel_cache
 
 
 class Message:
@@ -11,6 +19,25 @@ class Message:
         self.plain_text = text
         self.fg = fg
         self.count = 1
+        # Wrapped lines of full_text by width, valid for the count they were made at.
+        self._wrapped: Dict[int, Tuple[str, ...]] = {}
+        self._wrapped_count = 1
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_wrapped"] = {}  # Cheap to rebuild, so it is not saved.
+        return state
+
+    def wrapped(self, width: int) -> Tuple[str, ...]:
+        """Return the lines of full_text wrapped to `width`, computed once per width."""
+        if self._wrapped_count != self.count:
+            # Stacking changed the " (xN)" suffix, so every wrapping is stale.
+            self._wrapped.clear()
+            self._wrapped_count = self.count
+        lines = self._wrapped.get(width)
+        if lines is None:
+            lines = self._wrapped[width] = tuple(MessageLog.wrap(self.full_text, width))
+        return lines
 
     @property
     def full_text(self) -> str:
@@ -20,9 +47,47 @@ class Message:
         return self.plain_text
 
 
+# Where messages which fell out of the in-memory log are kept, one file per run.
+HISTORY_DIR = "message_history"
+
+
 class MessageLog:
-    def __init__(self) -> None:
-        self.messages: List[Message] = []
+    """The message log of a run.
+
+    Only the newest `capacity` messages are kept in `messages`.  Older ones are
+    spilled in batches to an append-only file, one JSON line per message, and
+    are read back on demand by `get_messages`.
+    """
+
+    # How many messages are read from the spill file at once.
+    PAGE_SIZE = 256
+
+    def __init__(self, capacity: int = 500) -> None:
+        self.capacity = capacity
+        self.messages: Deque[Message] = deque()
+        # Bumped by add_message, so views of the log can tell when it changed.
+        self.version = 0
+        # The number of messages moved to the spill file so far.
+        self.spilled_count = 0
+        # The length of the spill file up to the last message spilled by this log.
+        self.spill_size = 0
+        self.spill_path = os.path.join(
+            HISTORY_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.log"
+        )
+        # Byte offset of each spilled message, rebuilt from the file after loading.
+        self._spill_offsets: Optional[array] = array("q")
+        # Line index per wrap width, see line_offsets.
+        self._line_offsets: Dict[int, array] = {}
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_spill_offsets"] = None
+        state["_line_offsets"] = {}
+        return state
+
+    def __len__(self) -> int:
+        """The number of messages in the whole history, including spilled ones."""
+        return self.spilled_count + len(self.messages)
 
     def add_message(
         self, text: str, fg: Tuple[int, int, int] = color.white, *, stack: bool = True,
@@ -36,6 +101,155 @@ class MessageLog:
             self.messages[-1].count += 1
         else:
             self.messages.append(Message(text, fg))
+            if len(self.messages) > self.capacity:
+                self._spill(max(1, self.capacity // 4))
+        self.version += 1
+
+    def _spill(self, count: int) -> None:
+        """Move the oldest `count` messages to the spill file."""
+        lines = [
+            json.dumps([message.plain_text, message.fg, message.count]).encode() + b"\n"
+            for message in islice(self.messages, count)
+        ]
+        offsets = self._get_spill_offsets()
+        try:
+            os.makedirs(HISTORY_DIR, exist_ok=True)
+            with open(self.spill_path, "ab") as f:
+                position = f.seek(0, os.SEEK_END)
+                for line in lines:
+                    offsets.append(position)
+                    position += len(line)
+                f.write(b"".join(lines))
+        except OSError:
+            # Keep the history in memory rather than losing it.
+            del offsets[self.spilled_count:]
+            return
+        for _ in range(count):
+            self.messages.popleft()
+        self.spilled_count += count
+        self.spill_size = position
+
+    def delete_spill_file(self) -> None:
+        """Delete the spill file of this log, such as when its run is over."""
+        try:
+            os.remove(self.spill_path)
+        except FileNotFoundError:
+            pass
+
+    def delete_other_spill_files(self) -> None:
+        """Delete the spill files of every other run.
+
+        Called when this log is saved, as the save only refers to this log's file.
+        """
+        try:
+            names = os.listdir(HISTORY_DIR)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(HISTORY_DIR, name)
+            if os.path.normpath(path) != os.path.normpath(self.spill_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _get_spill_offsets(self) -> array:
+        if self._spill_offsets is None:
+            self._spill_offsets = array("q")
+            try:
+                # Lines past the saved size were spilled by a session which was
+                # never saved.  Drop them, so new spills follow this log's lines.
+                if os.path.getsize(self.spill_path) > self.spill_size:
+                    os.truncate(self.spill_path, self.spill_size)
+                with open(self.spill_path, "rb") as f:
+                    position = 0
+                    for line in f:
+                        self._spill_offsets.append(position)
+                        position += len(line)
+            except FileNotFoundError:
+                pass
+            # Only lines which were spilled before this log was saved belong to it.
+            del self._spill_offsets[self.spilled_count:]
+        return self._spill_offsets
+
+    def get_messages(self, start: int, stop: int) -> List[Message]:
+        """Return the messages from index `start` up to `stop` of the whole history.
+
+        Spilled messages are read back from the spill file.
+        """
+        start = max(0, start)
+        stop = min(stop, len(self))
+        result: List[Message] = []
+        if start < min(stop, self.spilled_count):
+            result.extend(self._read_spilled(start, min(stop, self.spilled_count)))
+        if stop > self.spilled_count:
+            in_memory_start = max(start, self.spilled_count) - self.spilled_count
+            result.extend(
+                islice(self.messages, in_memory_start, stop - self.spilled_count)
+            )
+        return result
+
+    def _read_spilled(self, start: int, stop: int) -> List[Message]:
+        offsets = self._get_spill_offsets()
+        messages: List[Message] = []
+        if start < len(offsets):
+            with open(self.spill_path, "rb") as f:
+                for i in range(start, min(stop, len(offsets))):
+                    f.seek(offsets[i])
+                    text, fg, count = json.loads(f.readline())
+                    message = Message(text, tuple(fg))
+                    message.count = count
+                    messages.append(message)
+        # The spill file went missing, show placeholders rather than shifting the log.
+        while len(messages) < stop - start:
+            messages.append(Message("(history unavailable)", color.white))
+        return messages
+
+    def iter_messages(
+        self, start: int, stop: int, *, reverse: bool = False
+    ) -> Iterator[Tuple[int, Message]]:
+        """Yield (index, message) pairs of the history, paging it in a chunk at a time."""
+        start = max(0, start)
+        stop = min(stop, len(self))
+        if reverse:
+            for chunk_stop in range(stop, start, -self.PAGE_SIZE):
+                chunk_start = max(start, chunk_stop - self.PAGE_SIZE)
+                chunk = self.get_messages(chunk_start, chunk_stop)
+                for i in range(len(chunk) - 1, -1, -1):
+                    yield chunk_start + i, chunk[i]
+        else:
+            for chunk_start in range(start, stop, self.PAGE_SIZE):
+                chunk = self.get_messages(chunk_start, min(stop, chunk_start + self.PAGE_SIZE))
+                yield from enumerate(chunk, chunk_start)
+
+    def line_offsets(self, width: int) -> array:
+        """Return where each message starts when the history is wrapped to `width`.
+
+        Item `i` is the first line of message `i`, and the last item is the
+        total number of lines.  The index is kept per width and extended as
+        messages are added, so only new messages are wrapped.
+        """
+        offsets = self._line_offsets.get(width)
+        if offsets is None:
+            offsets = self._line_offsets[width] = array("q", [0])
+        # The last indexed message may have stacked since, so it is always redone.
+        indexed = max(0, len(offsets) - 2)
+        del offsets[indexed + 1:]
+        for _, message in self.iter_messages(indexed, len(self)):
+            offsets.append(offsets[-1] + len(message.wrapped(width)))
+        return offsets
+
+    def search(self, text: str, start: int) -> Optional[int]:
+        """Return the index of the newest message containing `text`, at or before `start`.
+
+        The search is case insensitive and wraps around to the newest message.
+        """
+        text = text.lower()
+        for begin, end in ((0, start + 1), (start + 1, len(self))):
+            for i, message in self.iter_messages(begin, end, reverse=True):
+                if text in message.plain_text.lower():
+                    return i
+        return None
 
     def render(
         self, console: tcod.Console, x: int, y: int, width: int, height: int,
@@ -43,8 +257,19 @@ class MessageLog:
         """Render this log over the given area.
         `x`, `y`, `width`, `height` is the rectangular region to render onto
         the `console`.
+        The area is kept as an off-screen console which is only redrawn after
+        add_message changed the log.
         """
-        self.render_messages(console, x, y, width, height, self.messages)
+        panel_cache.blit(
+            console,
+            x,
+            y,
+            "message_log",
+            (self, self.version),
+            width,
+            height,
+            lambda panel: self.render_messages(panel, 0, 0, width, height, self.messages),
+        )
 
     @staticmethod
     def wrap(string: str, width: int) -> Iterable[str]:
@@ -71,7 +296,7 @@ class MessageLog:
         y_offset = height - 1
 
         for message in reversed(messages):
-            for line in reversed(list(cls.wrap(message.full_text, width))):
+            for line in reversed(message.wrapped(width)):
                 console.print(x=x, y=y + y_offset, string=line, fg=message.fg)
                 y_offset -= 1
                 if y_offset < 0:
@@ -1,12 +1,15 @@
 from __future__ import annotations
 
-import random
-from typing import Dict, Iterator, List, Tuple, TYPE_CHECKING
+import bisect
+import functools
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple, TYPE_CHECKING
 
-import tcod
+import numpy as np
 
+from entity import Actor
 import entity_factories
-from game_map import GameMap
+from game_map import GameMap, ItemRecord, SpawnRecord
+from rng_streams import FloorStreams
 import tile_types
 
 
@@ -15,6 +18,11 @@ if TYPE_CHECKING:
     from entity import Entity
 
 
+# Bump this whenever a change makes the same seed build a different floor,
+# so floors cached by older versions are not used.
+GENERATOR_VERSION = 4
+
+
 # max_items_by_floor = [
 #     (1, 1),
 #     (4, 2),
@@ -82,6 +90,23 @@ enemy_chances: Dict[int, List[Tuple[Entity, int]]] = {
     15: [(entity_factories.rattlesnake, 0), (entity_factories.wraith, 0), (entity_factories.dragon, 1000)],
 }
 
+# Monster prototypes by name, so spawn records only need to store the name.
+monster_prototypes: Dict[str, Entity] = {
+    entity.name: entity
+    for chances in enemy_chances.values()
+    for entity, _ in chances
+}
+
+# Item prototypes by name, see ItemRecord.
+item_prototypes: Dict[str, Entity] = {
+    entity.name: entity
+    for chances in item_chances.values()
+    for entity, _ in chances
+}
+
+# Weapons which roll a power bonus when they are placed.
+BONUS_WEAPONS = ("Sword", "Super Sword", "Master Sword")
+
 
 def get_max_value_for_floor(
     max_value_by_floor: List[Tuple[int, int]], floor: int
@@ -110,31 +135,71 @@ def get_max_rooms_for_floor(weighted_chances: list[tuple[int, int]], floor: int)
     return current_value
 
 
-def get_entities_at_random(
-    weighted_chances_by_floor: Dict[int, List[Tuple[Entity, int]]],
-    number_of_entities: int,
-    floor: int,
-) -> List[Entity]:
-    entity_weighted_chances = {}
+class FloorLimits(NamedTuple):
+    """The per-floor maximums of the tables above."""
 
-    for key, values in weighted_chances_by_floor.items():
-        if key > floor:
-            break
-        else:
-            for value in values:
-                entity = value[0]
-                weighted_chance = value[1]
+    max_rooms: int
+    max_monsters: int
+    max_items: int
+
+
+@functools.lru_cache(maxsize=None)
+def get_floor_limits(floor: int) -> FloorLimits:
+    """Return the maximums of a floor, looked up once per floor."""
+    return FloorLimits(
+        max_rooms=get_max_rooms_for_floor(max_rooms_by_floor, floor),
+        max_monsters=get_max_value_for_floor(max_monsters_by_floor, floor),
+        max_items=get_max_value_for_floor(max_items_by_floor, floor),
+    )
+
+
+class SpawnTable:
+    """The weighted chances of one floor, compiled for fast sampling.
+
+    The weights are stored as a cumulative array, so any number of entities is
+    picked with one vectorized binary search.
+    """
+
+    def __init__(self, weighted_chances: Dict[Entity, int]):
+        self.entities = [entity for entity, weight in weighted_chances.items() if weight > 0]
+        self.cumulative_weights = np.cumsum(
+            [weighted_chances[entity] for entity in self.entities], dtype=np.int64
+        )
 
+    def sample(self, rng: np.random.Generator, count: int) -> List[Entity]:
+        """Return `count` entities picked by weight."""
+        if count <= 0 or not self.entities:
+            return []
+        picks = self.cumulative_weights.searchsorted(
+            rng.integers(0, self.cumulative_weights[-1], size=count), side="right"
+        )
+        return [self.entities[i] for i in picks.tolist()]
+
+
+class SpawnTables:
+    """A SpawnTable for every floor where `weighted_chances_by_floor` changes."""
+
+    def __init__(self, weighted_chances_by_floor: Dict[int, List[Tuple[Entity, int]]]):
+        self.floor_minimums: List[int] = []
+        self.tables: List[SpawnTable] = []
+        entity_weighted_chances: Dict[Entity, int] = {}
+        for key, values in sorted(weighted_chances_by_floor.items()):
+            # Later floors override the chances of the entities they list.
+            for entity, weighted_chance in values:
                 entity_weighted_chances[entity] = weighted_chance
+            self.floor_minimums.append(key)
+            self.tables.append(SpawnTable(entity_weighted_chances))
 
-    entities = list(entity_weighted_chances.keys())
-    entity_weighted_chance_values = list(entity_weighted_chances.values())
+    def for_floor(self, floor: int) -> SpawnTable:
+        index = bisect.bisect_right(self.floor_minimums, floor) - 1
+        if index < 0:
+            return SpawnTable({})
+        return self.tables[index]
 
-    chosen_entities = random.choices(
-        entities, weights=entity_weighted_chance_values, k=number_of_entities
-    )
 
-    return chosen_entities
+# Compiled once, at import.
+enemy_spawn_tables = SpawnTables(enemy_chances)
+item_spawn_tables = SpawnTables(item_chances)
 
 
 class RectangularRoom:
@@ -165,117 +230,193 @@ class RectangularRoom:
             and self.y2 >= other.y1
         )
 
-def place_entities(room: RectangularRoom, dungeon: GameMap, floor_number: int,) -> None:
-    number_of_monsters = random.randint(
-        0, get_max_value_for_floor(max_monsters_by_floor, floor_number)
+def place_entities(
+    room: RectangularRoom,
+    dungeon: GameMap,
+    floor_number: int,
+    streams: FloorStreams,
+    number_of_monsters: int,
+    number_of_items: int,
+) -> None:
+    spawns = streams.spawns
+    monsters: List[Entity] = enemy_spawn_tables.for_floor(floor_number).sample(
+        spawns, number_of_monsters
     )
-    number_of_items = random.randint(
-        0, get_max_value_for_floor(max_items_by_floor, floor_number)
+    items: List[Entity] = item_spawn_tables.for_floor(floor_number).sample(
+        spawns, number_of_items
     )
 
-    monsters: List[Entity] = get_entities_at_random(
-        enemy_chances, number_of_monsters, floor_number
-    )
-    items: List[Entity] = get_entities_at_random(
-        item_chances, number_of_items, floor_number
-    )
-
-    for entity in monsters + items:
-        x = random.randint(room.x1 + 1, room.x2 - 1)
-        y = random.randint(room.y1 + 1, room.y2 - 1)
-
-        if not any(entity.x == x and entity.y == y for entity in dungeon.entities):
-            # スポーンさせて、その個体を変数 instance に入れる
-            instance = entity.spawn(dungeon, x, y)
-
+    room_index = dungeon.get_room_at(*room.center)
+    recorded_locations: Set[Tuple[int, int]] = set()
+
+    # The positions of the whole room are drawn at once.
+    entities = monsters + items
+    xs = spawns.integers(room.x1 + 1, room.x2, size=len(entities)).tolist()
+    ys = spawns.integers(room.y1 + 1, room.y2, size=len(entities)).tolist()
+
+    for entity, x, y in zip(entities, xs, ys):
+        if (
+            (x, y) in recorded_locations
+            or (x, y) == dungeon.entry_location  # The player arrives here.
+            or dungeon.get_entities_at_location(x, y)
+        ):
+            continue
+
+        if isinstance(entity, Actor):
+            # Monsters are only recorded here and created when the player comes
+            # near, see GameMap.materialize_room.
+            dungeon.spawn_records.setdefault(room_index, []).append(
+                SpawnRecord(entity.name, x, y)
+            )
+            recorded_locations.add((x, y))
+        else:
             # --- ここからランダム性能の付与ロジック ---
+            bonus = 0
             # ゴールドの場合
-            if instance.name == "Gold":
-                instance.consumable.amount = random.choice([20, 30, 50])
-            
+            if entity.name == "Gold":
+                bonus = int(streams.bonuses.choice([20, 30, 50]))
             # 剣の場合（将来の実装イメージ）
-            elif instance.name == "Sword":
-                bonus = random.randint(0, 3) # 0〜3の強化値
-                if bonus > 0:
-                    instance.name = f"Sword +{bonus}"
-                    instance.equippable.power_bonus += bonus
-            elif instance.name == "Super Sword":
-                bonus = random.randint(0, 3) # 0〜3の強化値
-                if bonus > 0:
-                    instance.name = f"Super Sword +{bonus}"
-                    instance.equippable.power_bonus += bonus
-            elif instance.name == "Master Sword":
-                bonus = random.randint(0, 3) # 0〜3の強化値
-                if bonus > 0:
-                    instance.name = f"Master Sword +{bonus}"
-                    instance.equippable.power_bonus += bonus
-
-
-def tunnel_between(
-    start: Tuple[int, int], end: Tuple[int, int]
-) -> Iterator[Tuple[int, int]]:
-    """Return an L-shaped tunnel between these two points."""
+            elif entity.name in BONUS_WEAPONS:
+                bonus = int(streams.bonuses.integers(0, 4)) # 0〜3の強化値
+
+            record = ItemRecord(entity.name, x, y, bonus)
+            dungeon.item_records.append(record)
+            spawn_item(dungeon, record)
+
+
+def spawn_item(dungeon: GameMap, record: ItemRecord) -> None:
+    """Spawn the item of a record from its prototype, applying its rolled bonus."""
+    # スポーンさせて、その個体を変数 instance に入れる
+    instance = item_prototypes[record.prototype].spawn(dungeon, record.x, record.y)
+
+    if instance.name == "Gold":
+        instance.consumable.amount = record.bonus
+    elif instance.name in BONUS_WEAPONS and record.bonus > 0:
+        instance.name = f"{instance.name} +{record.bonus}"
+        instance.equippable.power_bonus += record.bonus
+
+
+class RoomPlacer:
+    """Finds free spots for rooms with an occupancy bitmap of the map.
+
+    Every spot a room of the requested size fits in is found at once from a
+    summed-area table, so a room is placed whenever there is space for it
+    instead of retrying random positions.
+    """
+
+    def __init__(self, width: int, height: int):
+        self.width, self.height = width, height
+        # Tiles covered by a placed room, its walls included.
+        self.occupied = np.zeros((width, height), dtype=np.int32, order="F")
+
+    def place(self, room_width: int, room_height: int, roll: float) -> Optional[RectangularRoom]:
+        """Return a room of this size which doesn't intersect any placed room.
+
+        `roll` in [0, 1) picks one of the free spots.  Returns None if none is left.
+        """
+        # A room at x, y covers x..x+room_width and y..y+room_height, like intersects.
+        span_x = self.width - room_width
+        span_y = self.height - room_height
+        if span_x <= 0 or span_y <= 0:
+            return None
+        table = np.zeros((self.width + 1, self.height + 1), dtype=np.int32)
+        table[1:, 1:] = self.occupied.cumsum(axis=0).cumsum(axis=1)
+        w, h = room_width + 1, room_height + 1
+        covered = (
+            table[w:w + span_x, h:h + span_y]
+            - table[:span_x, h:h + span_y]
+            - table[w:w + span_x, :span_y]
+            + table[:span_x, :span_y]
+        )
+        free = np.flatnonzero(covered == 0)
+        if free.size == 0:
+            return None
+        x, y = divmod(int(free[int(roll * free.size)]), span_y)
+
+        room = RectangularRoom(x, y, room_width, room_height)
+        self.occupied[room.x1:room.x2 + 1, room.y1:room.y2 + 1] = 1
+        return room
+
+
+def carve_tunnel(
+    dungeon: GameMap, start: Tuple[int, int], end: Tuple[int, int], horizontal_first: bool
+) -> None:
+    """Dig an L-shaped tunnel between these two points."""
     x1, y1 = start
     x2, y2 = end
-    if random.random() < 0.5:  # 50% chance.
+    if horizontal_first:
         # Move horizontally, then vertically.
         corner_x, corner_y = x2, y1
     else:
         # Move vertically, then horizontally.
         corner_x, corner_y = x1, y2
 
-    # Generate the coordinates for this tunnel.
-    for x, y in tcod.los.bresenham((x1, y1), (corner_x, corner_y)).tolist():
-        yield x, y
-    for x, y in tcod.los.bresenham((corner_x, corner_y), (x2, y2)).tolist():
-        yield x, y
+    # Each leg is a straight line, so it is carved as one slice.
+    dungeon.tiles[min(x1, x2):max(x1, x2) + 1, corner_y] = tile_types.floor
+    dungeon.tiles[corner_x, min(y1, y2):max(y1, y2) + 1] = tile_types.floor
 
 
-def generate_dungeon(
+def build_dungeon(
     max_rooms: int,
     room_min_size: int,
     room_max_size: int,
     map_width: int,
     map_height: int,
     engine: Engine,
+    floor_number: int,
+    streams: FloorStreams,
 ) -> GameMap:
-    """Generate a new dungeon map."""
-    player = engine.player
-    dungeon = GameMap(engine, map_width, map_height, entities=[player])
-    
+    """Carve a new dungeon map and place its items and monsters.
+
+    This only reads its arguments and draws from `streams`, so it is safe to
+    run in a worker thread while another floor is played.  The player is put
+    in the map afterwards by enter_dungeon.
+    """
+    dungeon = GameMap(engine, map_width, map_height)
+
     rooms: List[RectangularRoom] = []
 
     center_of_last_room = (0, 0)
 
-    for r in range(max_rooms):
-        room_width = random.randint(room_min_size, room_max_size)
-        room_height = random.randint(room_min_size, room_max_size)
+    # Every attempt's numbers are drawn up front, one array per kind of roll.
+    room_widths = streams.rooms.integers(room_min_size, room_max_size + 1, size=max_rooms)
+    room_heights = streams.rooms.integers(room_min_size, room_max_size + 1, size=max_rooms)
+    position_rolls = streams.rooms.random(max_rooms).tolist()
+    horizontal_first = (streams.tunnels.random(max_rooms) < 0.5).tolist()  # 50% chance.
+    limits = get_floor_limits(floor_number)
+    monster_counts = streams.spawns.integers(0, limits.max_monsters + 1, size=max_rooms).tolist()
+    item_counts = streams.spawns.integers(0, limits.max_items + 1, size=max_rooms).tolist()
 
-        x = random.randint(0, dungeon.width - room_width - 1)
-        y = random.randint(0, dungeon.height - room_height - 1)
+    placer = RoomPlacer(dungeon.width, dungeon.height)
 
+    for r, (room_width, room_height) in enumerate(
+        zip(room_widths.tolist(), room_heights.tolist())
+    ):
         # "RectangularRoom" class makes rectangles easier to work with
-        new_room = RectangularRoom(x, y, room_width, room_height)
-
-        # Run through the other rooms and see if they intersect with this one.
-        if any(new_room.intersects(other_room) for other_room in rooms):
-            continue  # This room intersects, so go to the next attempt.
-        # If there are no intersections then the room is valid.
+        new_room = placer.place(room_width, room_height, position_rolls[r])
+        if new_room is None:
+            # No room of the rolled size fits anymore, the smallest size might.
+            new_room = placer.place(room_min_size, room_min_size, position_rolls[r])
+        if new_room is None:
+            break  # The map is full.
 
         # Dig out this rooms inner area.
         dungeon.tiles[new_room.inner] = tile_types.floor
+        room_index = dungeon.add_room(new_room)
 
         if len(rooms) == 0:
             # The first room, where the player starts.
-            player.place(*new_room.center, dungeon)
+            dungeon.entry_location = new_room.center
         else:  # All rooms after the first.
             # Dig out a tunnel between this room and the previous one.
-            for x, y in tunnel_between(rooms[-1].center, new_room.center):
-                dungeon.tiles[x, y] = tile_types.floor
+            carve_tunnel(dungeon, rooms[-1].center, new_room.center, horizontal_first[r])
+            dungeon.link_rooms(room_index - 1, room_index)
 
             center_of_last_room = new_room.center
 
-        place_entities(new_room, dungeon, engine.game_world.current_floor)
+        place_entities(
+            new_room, dungeon, floor_number, streams, monster_counts[r], item_counts[r]
+        )
 
         dungeon.tiles[center_of_last_room] = tile_types.down_stairs
         dungeon.downstairs_location = center_of_last_room
@@ -285,7 +426,34 @@ def generate_dungeon(
 
         # print(f"DEBUG: 部屋を作成しました。現在: {len(rooms)}個")
 
+    return dungeon
+
 
+def restore_dungeon(engine: Engine, tiles: np.ndarray, layout: dict) -> GameMap:
+    """Rebuild a dungeon from a layout stored by floor_cache, spawning its items anew."""
+    width, height = tiles.shape
+    dungeon = GameMap(engine, width, height)
+    dungeon.tiles[...] = tiles
+    for x1, y1, x2, y2 in layout["rooms"]:
+        dungeon.add_room(RectangularRoom(x1, y1, x2 - x1, y2 - y1))
+    dungeon.room_links = {room: list(links) for room, links in layout["room_links"].items()}
+    dungeon.spawn_records = {
+        room: [SpawnRecord(*record) for record in records]
+        for room, records in layout["spawn_records"].items()
+    }
+    for record in layout["item_records"]:
+        spawn_item(dungeon, ItemRecord(*record))
+    dungeon.downstairs_location = layout["downstairs_location"]
+    dungeon.entry_location = layout["entry_location"]
+    return dungeon
+
+
+def enter_dungeon(dungeon: GameMap, engine: Engine) -> None:
+    """Put the player at the entry of a built dungeon and record it in the logs."""
+    # The player is added to the map (and its location index) by player.place.
+    engine.player.place(*dungeon.entry_location, dungeon)
+
+    rooms = dungeon.rooms
     engine.total_rooms += len(rooms)
 
     # print(f"RESULT: 最終的な部屋の合計数: {len(rooms)}")     # デバッグ用に過去に使用
@@ -308,5 +476,3 @@ def generate_dungeon(
                 f"{engine.player.level.current_level}, {engine.player.fighter.power}, {engine.player.fighter.defense}\n"
                 )
             f.write(f"生成: 総部屋数 {len(rooms)} --> {engine.total_rooms}\n\n")
-
-    return dungeon
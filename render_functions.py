@@ -3,6 +3,7 @@ from __future__ import annotations
 from typing import Tuple, TYPE_CHECKING
 
 import color
+from console_cache import panel_cache
 
 if TYPE_CHECKING:
     from tcod import Console
@@ -15,25 +16,25 @@ def get_names_at_location(x: int, y: int, game_map: GameMap) -> str:
         return ""
 
     names = ", ".join(
-        entity.name for entity in game_map.entities if entity.x == x and entity.y == y
+        entity.name for entity in game_map.get_entities_at_location(x, y)
     )
 
     return names.capitalize()
 
 def render_bar(
-    console: Console, current_value: int, maximum_value: int, total_width: int
+    console: Console, current_value: int, maximum_value: int, total_width: int, y: int = 45
 ) -> None:
     bar_width = int(float(current_value) / maximum_value * total_width)
 
-    console.draw_rect(x=0, y=45, width=total_width, height=1, ch=1, bg=color.bar_empty)
+    console.draw_rect(x=0, y=y, width=total_width, height=1, ch=1, bg=color.bar_empty)
 
     if bar_width > 0:
         console.draw_rect(
-            x=0, y=45, width=bar_width, height=1, ch=1, bg=color.bar_filled
+            x=0, y=y, width=bar_width, height=1, ch=1, bg=color.bar_filled
         )
 
     console.print(
-        x=1, y=45, string=f"HP: {current_value}/{maximum_value}", fg=color.bar_text
+        x=1, y=y, string=f"HP: {current_value}/{maximum_value}", fg=color.bar_text
     )
 
 def render_dungeon_level(
@@ -57,5 +58,31 @@ def render_names_at_mouse_location(
 
     console.print(x=x, y=y, string=names_at_mouse_location)
 
-    # 画面の端などにゴールドを表示
-    console.print(x=1, y=48, string=f"Gold: {engine.player.gold}", fg=(255, 215, 0))
\ No newline at end of file
+def render_status_panel(
+    console: Console, engine: Engine, location: Tuple[int, int]
+) -> None:
+    """
+    Render the HP bar, dungeon level and gold as one panel at the given location.
+    The panel is kept off-screen and only redrawn when one of its values changes.
+    """
+    x, y = location
+    fighter = engine.player.fighter
+    dungeon_level = engine.game_world.current_floor
+    gold = engine.player.gold
+
+    def draw(panel: Console) -> None:
+        render_bar(
+            console=panel,
+            current_value=fighter.hp,
+            maximum_value=fighter.max_hp,
+            total_width=20,
+            y=0,
+        )
+        render_dungeon_level(console=panel, dungeon_level=dungeon_level, location=(0, 2))
+        # 画面の端などにゴールドを表示
+        panel.print(x=1, y=3, string=f"Gold: {gold}", fg=(255, 215, 0))
+
+    panel_cache.blit(
+        console, x, y, "status", (fighter.hp, fighter.max_hp, dungeon_level, gold),
+        width=20, height=4, draw=draw,
+    )
\ No newline at end of file
@@ -0,0 +1,33 @@
+"""Independent NumPy random streams derived from the run seed.
+
+Each subsystem draws from its own Generator, so adding a draw to one of them
+never shifts the numbers another one gets.  Floors get their own set of
+streams, which only depends on the run seed and the floor number, so a floor
+comes out the same no matter when or on which thread it is built.
+"""
+from __future__ import annotations
+
+from typing import NamedTuple
+import zlib
+
+import numpy as np
+
+
+class FloorStreams(NamedTuple):
+    """The random streams used to generate one floor."""
+
+    rooms: np.random.Generator  # Room sizes and positions.
+    tunnels: np.random.Generator  # Which way each L-shaped tunnel turns.
+    spawns: np.random.Generator  # Monster and item counts, kinds and positions.
+    bonuses: np.random.Generator  # Gold amounts and weapon bonuses.
+
+
+def floor_streams(run_seed: int, floor: int) -> FloorStreams:
+    """Return the streams of a floor."""
+    children = np.random.SeedSequence([run_seed, floor]).spawn(len(FloorStreams._fields))
+    return FloorStreams(*(np.random.default_rng(child) for child in children))
+
+
+def run_stream(run_seed: int, name: str) -> np.random.Generator:
+    """Return the stream of a subsystem which lives for the whole run, such as "ai"."""
+    return np.random.default_rng([run_seed, zlib.crc32(name.encode())])
@@ -8,6 +8,9 @@ VERSION = "v 0.1.3+"
 SCORES_FILE = "high_scores.json"
 DEBUG_LOG_FILE = "high_scores.txt"
 
+# スコアを保存するたびに増える。ランキング画面のキャッシュ判定に使う
+scores_version = 0
+
 def save_score(gold: int, floor: int, level: int):
     # 既存のスコアを読み込む
     scores = load_scores()
@@ -26,6 +29,7 @@ def save_score(gold: int, floor: int, level: int):
     
     with open(SCORES_FILE, "w") as f:
         json.dump(scores, f)
+    _scores_saved()
 
 def save_detailed_score(engine, gold, is_cleared=False):          # ===デバッグ記録用===
     player = engine.player
@@ -63,6 +67,7 @@ def save_detailed_score(engine, gold, is_cleared=False):          # ===デバッ
     scores.sort(key=lambda x: x["gold"], reverse=True)
     with open(SCORES_FILE, "w") as f:
         json.dump(scores[:30], f)
+    _scores_saved()
 
     # --- 2. TXT (デバッグログ用) への追記 ---
     with open(DEBUG_LOG_FILE, "a", encoding="utf-8") as f:
@@ -77,6 +82,18 @@ def save_detailed_score(engine, gold, is_cleared=False):          # ===デバッ
 
     return score_data
 
+def _scores_saved() -> None:
+    global scores_version
+    scores_version += 1
+
+def scores_signature():
+    """スコアファイルが変わったかを判定するための値を返す（読み込みはしない）"""
+    try:
+        stat = os.stat(SCORES_FILE)
+    except FileNotFoundError:
+        return (scores_version, None)
+    return (scores_version, stat.st_mtime_ns, stat.st_size)
+
 def load_scores():
     if not os.path.exists(SCORES_FILE):
         return []
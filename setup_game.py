@@ -11,19 +11,22 @@ import tcod
 from tcod import libtcodpy
 
 import color
+from console_cache import panel_cache
 from engine import Engine
 import entity_factories
 from game_map import GameWorld
 import input_handlers
-from procgen import generate_dungeon
 
 
 # Load the background image and remove the alpha channel.
 background_image = tcod.image.load("menu_background.png")[:, :, :3]
 
 
-def new_game() -> Engine:
-    """Return a brand new game session as an Engine instance."""
+def new_game(seed: Optional[int] = None) -> Engine:
+    """Return a brand new game session as an Engine instance.
+
+    Runs with the same `seed` get the same floors, a random one is used if it is None.
+    """
     map_width = 80
     map_height = 43
 
@@ -42,6 +45,7 @@ def new_game() -> Engine:
         room_max_size=room_max_size,
         map_width=map_width,
         map_height=map_height,
+        seed=seed,
     )
 
     engine.game_world.generate_floor()
@@ -78,6 +82,12 @@ class MainMenu(input_handlers.BaseEventHandler):
     """Handle the main menu rendering and input."""
 
     def on_render(self, console: tcod.Console) -> None:
+        """Render the main menu, which never changes, from its cached console."""
+        panel_cache.blit(
+            console, 0, 0, "main_menu", None, console.width, console.height, self.draw_menu
+        )
+
+    def draw_menu(self, console: tcod.Console) -> None:
         """Render the main menu on a background image."""
         console.draw_semigraphics(background_image, 0, 0)
 
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import heapq
+from typing import Dict, Iterator, List, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from entity import Actor
+
+# Game time taken by one action of an actor with a speed of 100.
+TURN_LENGTH = 100
+
+
+def action_delay(actor: Actor) -> int:
+    """Return how much game time passes between this actors actions."""
+    return TURN_LENGTH * 100 // max(1, actor.speed)
+
+
+class TurnScheduler:
+    """Decides which actors act, and in which order, as game time passes.
+
+    Actors are kept in a heap ordered by the time of their next action.  Ties are
+    broken by the order the actors were added, so turns are reproducible.
+    """
+
+    def __init__(self) -> None:
+        self.time = 0
+        self._heap: List[Tuple[int, int, Actor]] = []
+        # The registry of scheduled actors and the time they will next act.
+        # Heap entries which don't match this are stale and get skipped.
+        self._next_time: Dict[Actor, int] = {}
+        self._counter = 0
+
+    def __len__(self) -> int:
+        return len(self._next_time)
+
+    def __contains__(self, actor: Actor) -> bool:
+        return actor in self._next_time
+
+    def add(self, actor: Actor) -> None:
+        """Schedule an actor to act one action delay from now."""
+        self._schedule(actor, self.time + action_delay(actor))
+
+    def remove(self, actor: Actor) -> None:
+        """Stop scheduling this actor, such as when it dies or leaves the map."""
+        self._next_time.pop(actor, None)
+
+    def _schedule(self, actor: Actor, time: int) -> None:
+        self._next_time[actor] = time
+        self._counter += 1
+        heapq.heappush(self._heap, (time, self._counter, actor))
+
+    def advance(self, duration: int) -> Iterator[Actor]:
+        """Move time forward by `duration`, yielding actors as their turns come up.
+
+        Fast actors may be yielded more than once.  Each actor is rescheduled
+        before it is yielded, so it can safely be removed during its own turn.
+        """
+        end_time = self.time + duration
+        while self._heap and self._heap[0][0] <= end_time:
+            time, _, actor = heapq.heappop(self._heap)
+            if self._next_time.get(actor) != time:
+                continue  # Removed or rescheduled since this entry was pushed.
+            self.time = time
+            self._schedule(actor, time + action_delay(actor))
+            yield actor
+        self.time = end_time